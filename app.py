@@ -1,12 +1,26 @@
 import os
-import json
+import io
 import re
-import inspect
+import csv
+import json
+import asyncio
+import hashlib
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import astuple, replace
+from itertools import islice
 import streamlit as st
 
-from google import genai
+try:
+    import orjson
+except ImportError:  # optional: stdlib json fallback
+    orjson = None
 
-from core import mediation, memory, schema
+from core import cache, memory, prompts, schema
+from core.perception import JsonCloseDetector, extract_tension_level, parse_constitution_rules, safe_parse_json
+from core.schema import TurnInputs, shallow_asdict
 
 
 # -------------------------
@@ -20,10 +34,28 @@ st.caption("Constitution → Perception Events → Mediation → Ledger → Vibe
 # -------------------------
 # Secrets / API key
 # -------------------------
+@st.cache_resource
+def _bootstrap():
+    # .env is read once per process instead of on every rerun.
+    try:
+        from dotenv import load_dotenv
+    except ImportError:  # optional: python-dotenv
+        return False
+    return load_dotenv()
+
+
+_bootstrap()
+
+
 def get_api_key():
-    if "GEMINI_API_KEY" in st.secrets:
-        return st.secrets["GEMINI_API_KEY"]
-    return os.getenv("GEMINI_API_KEY")
+    key = os.getenv("GEMINI_API_KEY")
+    if key:
+        return key
+    # Without a secrets.toml, even probing st.secrets raises.
+    try:
+        return st.secrets.get("GEMINI_API_KEY")
+    except Exception:
+        return None
 
 
 api_key = get_api_key()
@@ -31,111 +63,571 @@ if not api_key:
     st.error('Missing GEMINI_API_KEY. Streamlit Secrets must be TOML like:  GEMINI_API_KEY="YOUR_KEY"')
     st.stop()
 
-client = genai.Client(api_key=api_key)
+
+@st.cache_resource(show_spinner=False)
+def get_client(key: str):
+    # Deferred: the SDK import is heavy and only needed once a Gemini call is made.
+    from google import genai
+
+    return genai.Client(api_key=key)
+
+
+@st.cache_resource
+def get_event_loop():
+    # The cached client's async connection pool is bound to the loop that opened it,
+    # so all coroutines run on one long-lived loop rather than a fresh asyncio.run() loop.
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="halo-aio", daemon=True).start()
+    return loop
+
+
+def run_async(coro):
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+
+def run_async_streamed(coro_factory, placeholder):
+    # coro_factory(on_text) runs on the event loop; text chunks are rendered here,
+    # on the script thread, as they arrive.
+    chunks = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(coro_factory(chunks.put), get_event_loop())
+    parts = []
+    while not future.done() or not chunks.empty():
+        try:
+            parts.append(chunks.get(timeout=0.05))
+        except queue.Empty:
+            continue
+        placeholder.code("".join(parts), language="json")
+    return future.result()
+
+
+def client():
+    # Built on first use (Run, Batch eval), not at import: the first render never waits on the SDK.
+    return get_client(api_key)
 
 
 # -------------------------
 # Helpers
 # -------------------------
-def safe_parse_json(text: str):
-    if not text:
-        return None
-    text = text.strip()
-    try:
-        return json.loads(text)
-    except Exception:
-        m = re.search(r"\{.*\}", text, re.S)
-        if m:
-            try:
-                return json.loads(m.group(0))
-            except Exception:
-                return None
-        return None
+@st.cache_data(ttl=3600, show_spinner=False)
+def _cached_tension_level(events_dict):
+    return extract_tension_level(events_dict)
+
+
+def dumps_pretty(obj) -> bytes:
+    # Dataclass records go through shallow_asdict on both paths (no asdict deep copy first),
+    # which also keeps internal fields such as ts_epoch out of the output.
+    if orjson is not None:
+        return orjson.dumps(
+            obj,
+            default=shallow_asdict,
+            option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATACLASS,
+        )
+    return json.dumps(obj, ensure_ascii=False, indent=2, default=shallow_asdict).encode("utf-8")
+
+
+_MD_SPECIAL = re.compile(r"([\\`*_{}\[\]()#+\-.!|<>~$])")
+
 
+def md_escape(value) -> str:
+    # Model text is shown literally: no markdown, no $...$ math, no line breaks escaping the bullet.
+    return _MD_SPECIAL.sub(r"\\\1", " ".join(str(value).split()))
 
-def pick_callable(mod, candidates):
-    for name in candidates:
-        fn = getattr(mod, name, None)
-        if callable(fn):
-            return fn, name
-    return None, None
 
+def receipt_markdown(med) -> str:
+    # The whole receipt as one markdown string: one st.markdown call instead of one widget per item.
+    receipt = med.get("fact_receipt", {})
+    debrief = med.get("post_conflict_debrief", {})
 
-def call_best(fn, **kwargs):
-    sig = inspect.signature(fn)
-    accepted = {}
-    for k, v in kwargs.items():
-        if k in sig.parameters:
-            accepted[k] = v
-    return fn(**accepted)
+    def bullets(lines):
+        return "\n".join(f"- {line}" for line in lines) or "- (none)"
+
+    def esc(e, k, default=""):
+        return md_escape(e.get(k, default))
+
+    return "\n\n".join(
+        [
+            "**Evidence from chat**",
+            bullets(
+                f"({esc(e, 'speaker', '?')}) \"{esc(e, 'quote')}\" — {esc(e, 'why_it_matters')}"
+                for e in receipt.get("evidence_from_chat", [])
+            ),
+            "**Evidence from constitution**",
+            bullets(
+                f"\"{esc(e, 'rule_excerpt')}\" — {esc(e, 'why_it_matters')}"
+                for e in receipt.get("evidence_from_constitution", [])
+            ),
+            "**Debrief for A**",
+            bullets(md_escape(line) for line in debrief.get("for_A", [])),
+            "**Debrief for B**",
+            bullets(md_escape(line) for line in debrief.get("for_B", [])),
+        ]
+    )
+
+
+def buffer_key(buf):
+    # Buffers only change by (append|appendleft) + time pruning, so length + head timestamp identify a version.
+    return len(buf), (buf[0].ts_utc if buf else None)
+
+
+def session_memo(name: str, key, build):
+    # Per-session memo: reruns with an unchanged key reuse the previous result.
+    memo = st.session_state.setdefault("_memo", {})
+    hit = memo.get(name)
+    if hit is None or hit[0] != key:
+        hit = memo[name] = (key, build())
+    return hit[1]
 
 
 # -------------------------
-# Prompts (Perception in app.py, since core/perception.py has no entrypoint)
+# Gemini stages (prompts live in core/prompts.py)
 # -------------------------
-def build_perception_prompt(chat: str, constitution_text: str, context_text: str) -> str:
-    return f"""
-You are the "Perception Layer" of a neutral home AI system (DEMO).
-Given constitution + chat + optional context, produce structured "Perception Events".
-
-Constraints:
-- This is a simulation demo. Do NOT invent sensitive personal data.
-- Be neutral and non-therapeutic.
-- Quotes MUST be copied verbatim from the chat.
-
-Inputs:
-CONSTITUTION:
-\"\"\"{constitution_text}\"\"\"
-
-CONTEXT (optional):
-\"\"\"{context_text}\"\"\"
-
-CHAT:
-\"\"\"{chat}\"\"\"
-
-Return STRICT JSON only, schema:
-{{
-  "events": [
-    {{
-      "type": "SpeechEvent",
-      "timestamp_hint": "unknown|relative",
-      "speaker": "A|B|unknown",
-      "quote": "verbatim from chat",
-      "intent": "request|complaint|defense|clarify|boundary|repair_attempt|other",
-      "topic_tags": ["..."],
-      "implicit_need": "short"
-    }},
-    {{
-      "type": "TensionSignalEvent",
-      "timestamp_hint": "unknown|relative",
-      "level": "low|rising|high",
-      "signals": ["..."],
-      "explanation": "1 sentence neutral"
-    }}
-  ],
-  "notes": {{
-    "what_is_simulated": "1 sentence",
-    "privacy_statement": "1 sentence"
-  }}
-}}
-
-Rules:
-- Include 3–8 SpeechEvent items (quotes must appear in chat).
-- Include exactly 1 TensionSignalEvent.
-- STRICT JSON only. No markdown. No extra text.
-"""
+CONSTITUTION_CACHE_TTL_S = 3600
+
+
+# Interactive runs use the standard (or priority) tier; bulk eval runs tolerate
+# flex latency for the lower price.
+SERVICE_TIER_LIVE = "standard"
+SERVICE_TIER_BULK = "flex"
+
+
+def json_config(response_schema, cached_content=None, service_tier=None):
+    # Structured output: the model can only emit JSON matching response_schema.
+    from google.genai import types
+
+    return types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_schema=response_schema,
+        temperature=0.2,
+        cached_content=cached_content,
+        service_tier=service_tier,
+    )
 
 
-def gemini_perception(model: str, chat: str, constitution_text: str, context_text: str):
-    prompt = build_perception_prompt(chat, constitution_text, context_text)
-    resp = client.models.generate_content(model=model, contents=prompt)
-    raw = resp.text or ""
+def constitution_cache_name(model: str, constitution_text: str):
+    """Gemini context cache holding the constitution, or None to send it inline.
+
+    Created once per (model, constitution) and reused until it expires; a changed
+    constitution replaces it. Explicit caching has a per-model minimum size, so a
+    constitution estimated below it, or a rejected create, is remembered and the
+    constitution goes inline instead.
+    """
+    from google.genai import types
+
+    digest = hashlib.sha256(f"{model}\0{constitution_text}".encode("utf-8")).hexdigest()
+    entry = st.session_state.get("constitution_cache")
+    if entry and entry["digest"] == digest and entry["expires_at"] > time.time():
+        return entry["name"]
+    if entry and entry["name"]:
+        try:
+            client().caches.delete(name=entry["name"])
+        except Exception:
+            pass
+
+    name = None
+    # Below the explicit-cache minimum the create would be rejected, so it is not attempted.
+    if prompts.constitution_is_cacheable(constitution_text):
+        try:
+            created = client().caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    contents=[f"Household Constitution (shared rules/values):\n{constitution_text}"],
+                    ttl=f"{CONSTITUTION_CACHE_TTL_S}s",
+                ),
+            )
+            name = created.name
+        except Exception:
+            pass
+    # Refresh a little before the server-side TTL runs out.
+    st.session_state["constitution_cache"] = {
+        "digest": digest,
+        "name": name,
+        "expires_at": time.time() + CONSTITUTION_CACHE_TTL_S - 60,
+    }
+    return name
+
+
+def _checked(raw: str, validate):
     data = safe_parse_json(raw)
-    if not data or "events" not in data:
-        raise ValueError("Perception did not return valid JSON.")
+    if not isinstance(data, dict):
+        raise ValueError("Gemini did not return a JSON object.")
+    return validate(data) if validate else data
+
+
+async def cached_generate(
+    model: str, prompt: str, config, bypass_cache: bool = False, on_text=None, key_extra=(), validate=None
+):
+    # Keyed on a digest of (model, prompt): raw chat never lands on disk as a key.
+    # Only responses that pass `validate` are cached; a stale entry that no longer does is dropped.
+    key = cache.cache_key(model, prompt, *key_extra)
+    if not bypass_cache:
+        hit = cache.get(key)
+        if hit is not None:
+            try:
+                data = _checked(hit, validate)
+            except ValueError:
+                cache.delete(key)
+            else:
+                if on_text:
+                    on_text(hit)
+                return data
+    if on_text:
+        parts = []
+        closed = JsonCloseDetector()
+        stream = await client().aio.models.generate_content_stream(model=model, contents=prompt, config=config)
+        try:
+            async for chunk in stream:
+                text = chunk.text or ""
+                parts.append(text)
+                on_text(text)
+                # The next stage can be dispatched as soon as the object closes,
+                # without waiting for trailing chunks and stream shutdown.
+                if closed.feed(text):
+                    break
+        finally:
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        raw = "".join(parts)
+    else:
+        resp = await client().aio.models.generate_content(model=model, contents=prompt, config=config)
+        raw = resp.text or ""
+    data = _checked(raw, validate)
+    cache.set(key, raw)
     return data
 
 
+def _constitution_args(turn: TurnInputs, cached_content):
+    # With a context cache the prompt only points at the constitution, so the response
+    # cache key must carry the constitution itself.
+    if cached_content:
+        return replace(turn, constitution=prompts.CONSTITUTION_IN_CACHE), (turn.constitution,)
+    return turn, ()
+
+
+async def gemini_perception(
+    model: str,
+    turn: TurnInputs,
+    cached_content=None,
+    bypass_cache: bool = False,
+    on_text=None,
+    service_tier=None,
+):
+    turn, key_extra = _constitution_args(turn, cached_content)
+    prompt = prompts.sensor_prompt(turn, inline_schema=False)
+    config = json_config(schema.SENSOR_RESPONSE_SCHEMA, cached_content, service_tier)
+    return await cached_generate(
+        model,
+        prompt,
+        config,
+        bypass_cache=bypass_cache,
+        on_text=on_text,
+        key_extra=key_extra,
+        validate=schema.validate_sensor,
+    )
+
+
+async def gemini_mediation(
+    model: str,
+    events_json,
+    turn: TurnInputs,
+    cached_content=None,
+    bypass_cache: bool = False,
+    on_text=None,
+    service_tier=None,
+):
+    turn, key_extra = _constitution_args(turn, cached_content)
+    prompt = prompts.mediator_prompt(events_json, turn, inline_schema=False)
+    config = json_config(schema.MEDIATOR_RESPONSE_SCHEMA, cached_content, service_tier)
+    return await cached_generate(
+        model,
+        prompt,
+        config,
+        bypass_cache=bypass_cache,
+        on_text=on_text,
+        key_extra=key_extra,
+        validate=schema.validate_mediator,
+    )
+
+
+async def gemini_one_shot(
+    model: str,
+    turn: TurnInputs,
+    cached_content=None,
+    bypass_cache: bool = False,
+    on_text=None,
+    service_tier=None,
+):
+    # Perception + mediation in one round-trip, constrained to {"events": ..., "mediation": ...}.
+    turn, key_extra = _constitution_args(turn, cached_content)
+    prompt = prompts.combined_prompt(turn, inline_schema=False)
+    config = json_config(schema.COMBINED_RESPONSE_SCHEMA, cached_content, service_tier)
+    return await cached_generate(
+        model,
+        prompt,
+        config,
+        bypass_cache=bypass_cache,
+        on_text=on_text,
+        key_extra=key_extra,
+        validate=schema.validate_combined,
+    )
+
+
+def unpack_perception(perception_packet):
+    if isinstance(perception_packet, dict) and "events" in perception_packet:
+        inner = perception_packet["events"]
+        if isinstance(inner, dict) and "events" in inner:
+            return inner["events"], inner.get("notes", {})
+        if isinstance(inner, list):
+            return inner, perception_packet.get("notes", {})
+    return [], {}
+
+
+async def _run_stages(
+    model: str,
+    turn: TurnInputs,
+    one_shot: bool = True,
+    cached_content=None,
+    bypass_cache: bool = False,
+    on_text=None,
+    service_tier=None,
+):
+    if one_shot:
+        packet = await gemini_one_shot(
+            model,
+            turn,
+            cached_content=cached_content,
+            bypass_cache=bypass_cache,
+            on_text=on_text,
+            service_tier=service_tier,
+        )
+        events, notes = unpack_perception(packet)
+        return events, notes, packet["mediation"]
+
+    # Stage 2 depends on Stage 1, so the pair stays sequential; both are awaited on one loop.
+    perception_packet = await gemini_perception(
+        model=model,
+        turn=turn,
+        cached_content=cached_content,
+        bypass_cache=bypass_cache,
+        on_text=on_text,
+        service_tier=service_tier,
+    )
+    events, notes = unpack_perception(perception_packet)
+
+    # Stage 2 streams into the same placeholder, below the Stage 1 object.
+    if on_text:
+        on_text("\n\n")
+    med = await gemini_mediation(
+        model,
+        perception_packet,
+        turn,
+        cached_content=cached_content,
+        bypass_cache=bypass_cache,
+        on_text=on_text,
+        service_tier=service_tier,
+    )
+    return events, notes, med
+
+
+# -------------------------
+# Batch eval (Gemini Batch API: discounted, asynchronous, outside per-request rate limits)
+# -------------------------
+BATCH_POLL_S = 5
+BATCH_STAGE_TIMEOUT_S = 24 * 3600  # per job; the Batch API targets a 24h turnaround
+LIVE_CONCURRENCY = 8
+_BATCH_DONE = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+
+
+def _submit_batch(model: str, prompt_list, response_schema, display_name: str) -> str:
+    # One inlined batch job. Only its name is kept, so a rerun or page refresh can pick it up again.
+    # No service_tier here: the Batch API is already its own discounted tier.
+    config = json_config(response_schema)
+    job = client().batches.create(
+        model=model,
+        src=[{"contents": [{"role": "user", "parts": [{"text": p}]}], "config": config} for p in prompt_list],
+        config={"display_name": display_name},
+    )
+    return job.name
+
+
+def _batch_results(name: str, validate):
+    # None while the job is still running; otherwise one validated dict per prompt, in prompt order,
+    # with None for a request that errored or does not match its schema.
+    job = client().batches.get(name=name)
+    if job.state.name not in _BATCH_DONE:
+        return None
+    if job.state.name != "JOB_STATE_SUCCEEDED":
+        raise RuntimeError(f"Batch {name} ended in {job.state.name}.")
+    results = []
+    for r in job.dest.inlined_responses:
+        try:
+            results.append(_checked(r.response.text or "", validate) if r.response else None)
+        except ValueError:
+            results.append(None)
+    return results
+
+
+def eval_row(chat: str, perception_packet, med):
+    # perception_packet is None when the transcript failed before mediation.
+    con = med.get("conclusion", {})
+    return {
+        "chat": chat[:80],
+        "tension": extract_tension_level(perception_packet)[0] if perception_packet else "unknown",
+        "conclusion": con.get("type", "error" if perception_packet is None else "unknown"),
+        "summary": con.get("one_sentence_summary", ""),
+        "notify": bool(med.get("intervention_plan", {}).get("should_notify", False)),
+    }
+
+
+def start_batch(model: str, chats, constitution_text: str, context_text: str, mode: str):
+    """Submit the perception job for many transcripts, as the first of two Batch API jobs.
+
+    Returns the job state to keep in session_state; advance_batch polls it once
+    per rerun and submits the mediation job when perception is done.
+    """
+    turns = [TurnInputs(c, constitution_text, context_text, mode) for c in chats]
+    name = _submit_batch(
+        model,
+        [prompts.sensor_prompt(t, inline_schema=False) for t in turns],
+        schema.SENSOR_RESPONSE_SCHEMA,
+        "halo-perception",
+    )
+    return {
+        "id": name,
+        "model": model,
+        "chats": list(chats),
+        "turns": turns,
+        "stage": "perception",
+        "name": name,
+        "deadline": time.time() + BATCH_STAGE_TIMEOUT_S,
+    }
+
+
+def advance_batch(job):
+    """Poll the current batch job once; returns one summary row per chat when both stages are done, else None.
+
+    Transcripts whose perception errored or failed validation are reported and
+    skipped in the mediation batch.
+    """
+    if job["stage"] == "perception":
+        perceived = _batch_results(job["name"], schema.validate_sensor)
+        if perceived is None:
+            return None
+        ok = [i for i, p in enumerate(perceived) if p is not None]
+        job["perceived"], job["ok"] = perceived, ok
+        if ok:
+            # Submitted before the job is touched: a failed submit leaves it polling the finished perception job.
+            name = _submit_batch(
+                job["model"],
+                [prompts.mediator_prompt(perceived[i], job["turns"][i], inline_schema=False) for i in ok],
+                schema.MEDIATOR_RESPONSE_SCHEMA,
+                "halo-mediation",
+            )
+            job["stage"], job["name"] = "mediation", name
+            job["deadline"] = time.time() + BATCH_STAGE_TIMEOUT_S
+            return None
+        mediated = {}
+    else:
+        med_results = _batch_results(job["name"], schema.validate_mediator)
+        if med_results is None:
+            return None
+        mediated = {i: m for i, m in zip(job["ok"], med_results) if m is not None}
+    return [
+        eval_row(chat, job["perceived"][i] if i in mediated else None, mediated.get(i, {}))
+        for i, chat in enumerate(job["chats"])
+    ]
+
+
+@st.cache_resource
+def batch_registry():
+    # Running batch jobs by id, shared across sessions: a page refresh starts a new session,
+    # which finds its job again through the id kept in the URL.
+    return {}
+
+
+def track_batch(job) -> None:
+    batch_registry()[job["id"]] = job
+    st.session_state["batch_job"] = job
+    st.query_params["batch"] = job["id"]
+
+
+def untrack_batch() -> None:
+    job = st.session_state["batch_job"]
+    if job is not None:
+        batch_registry().pop(job["id"], None)
+    st.session_state["batch_job"] = None
+    st.query_params.pop("batch", None)
+
+
+def cancel_batch(job) -> None:
+    try:
+        client().batches.cancel(name=job["name"])
+    except Exception:
+        pass  # already finished, or gone server-side
+
+
+@st.fragment(run_every=BATCH_POLL_S)
+def batch_status(job) -> None:
+    # Reruns on its own timer, so polling never blocks or reruns the rest of the page;
+    # the whole app reruns only once the job is over.
+    st.info(f"Batch {job['stage']} job `{job['name']}` is running; checking every {BATCH_POLL_S}s.")
+    if st.button("Cancel batch", use_container_width=True):
+        cancel_batch(job)
+        untrack_batch()
+        st.rerun()
+    if time.time() > job["deadline"]:
+        cancel_batch(job)
+        untrack_batch()
+        st.session_state["batch_error"] = (
+            f"Batch {job['stage']} did not finish within {BATCH_STAGE_TIMEOUT_S // 3600}h and was cancelled."
+        )
+        st.rerun()
+    try:
+        rows = advance_batch(job)
+    except Exception as e:  # a failed job (RuntimeError) or an SDK / API error
+        cancel_batch(job)
+        untrack_batch()
+        st.session_state["batch_error"] = str(e)
+        st.rerun()
+    if rows is not None:
+        untrack_batch()
+        st.session_state["batch_rows"] = rows
+        st.rerun()
+
+
+async def run_many(model: str, chats, constitution_text: str, context_text: str, mode: str, bypass_cache: bool = False):
+    # Live alternative to the Batch API jobs: each transcript's stages stay sequential, transcripts run concurrently.
+    limit = asyncio.Semaphore(LIVE_CONCURRENCY)
+
+    async def one(chat):
+        async with limit:
+            events, notes, med = await _run_stages(
+                model,
+                TurnInputs(chat, constitution_text, context_text, mode),
+                one_shot=False,
+                bypass_cache=bypass_cache,
+                service_tier=SERVICE_TIER_BULK,
+            )
+            return {"events": events, "notes": notes}, med
+
+    results = await asyncio.gather(*[one(c) for c in chats], return_exceptions=True)
+    return [
+        eval_row(chat, None, {}) if isinstance(r, BaseException) else eval_row(chat, *r)
+        for chat, r in zip(chats, results)
+    ]
+
+
+def read_chat_csv(uploaded) -> list:
+    # One transcript per row: the "chat" column under a header row that names it; otherwise the
+    # file is headerless and every row's first column is a transcript. Raises UnicodeDecodeError.
+    rows = list(csv.reader(io.StringIO(uploaded.getvalue().decode("utf-8-sig"))))
+    header = [h.strip() for h in rows[0]] if rows else []
+    col = 0
+    if "chat" in header:
+        col, rows = header.index("chat"), rows[1:]
+    return [row[col] for row in rows if len(row) > col and row[col].strip()]
+
+
 # -------------------------
 # Defaults / session state
 # -------------------------
@@ -152,19 +644,52 @@ B: I thought you meant only the kitchen.
 A: We talked about trash day rules already...
 """
 
-for k in ["events", "med", "ledger", "vibe", "decay"]:
-    if k not in st.session_state:
-        st.session_state[k] = None
+VIBE_LEVEL_SCORE = {"low": 1, "rising": 2, "high": 3}
+
+
+_DEFAULTS = {"events": None, "med": None, "latest_ledger": None, "batch_rows": None, "batch_job": None}
+
+
+def ensure_state():
+    # Only the first run of a session builds the defaults; later reruns return here.
+    if "vibe_series" in st.session_state:
+        return
+    defaults = {
+        **_DEFAULTS,
+        # Ledger / vibe / tier buffers are bounded deques (see core/memory.py caps).
+        **memory.new_buffers(),
+        # Int-encoded tension per run for the vibe chart, appended once per run.
+        "vibe_series": deque(maxlen=60),
+    }
+    for k, v in defaults.items():
+        st.session_state.setdefault(k, v)
+
+
+ensure_state()
 
 
 # -------------------------
 # UI
 # -------------------------
+with st.sidebar:
+    bypass_cache = st.toggle("Bypass cache", value=False, help="Force fresh Gemini calls instead of reusing cached responses.")
+    one_shot = st.toggle("Single Gemini call", value=True, help="Run perception + mediation in one request.")
+    perception_mode = st.selectbox("Perception mode", ["conservative", "demo_mock"])
+    use_context_cache = st.toggle(
+        "Gemini context cache",
+        value=True,
+        help="Upload the constitution once as cached context instead of resending it with every call.",
+    )
+    priority_tier = st.toggle(
+        "Priority tier", value=False, help="Send the Run button's calls on the priority service tier (billed higher)."
+    )
+
 left, right = st.columns([1.05, 1.0], gap="large")
 
 with left:
     st.subheader("1) Household Constitution (shared rules)")
     constitution_text = st.text_area("constitution", value=DEFAULT_CONSTITUTION, height=220, label_visibility="collapsed")
+    st.caption(f"{len(parse_constitution_rules(constitution_text))} rules parsed")
 
     st.subheader("2) Scenario Input (chat)")
     chat_text = st.text_area("chat", value=DEFAULT_CHAT, height=180, label_visibility="collapsed")
@@ -176,146 +701,65 @@ with left:
 
     run_disabled = (not constitution_text.strip()) or (not chat_text.strip())
     if st.button("▶ Run HALO Loop", type="primary", use_container_width=True, disabled=run_disabled):
-        with st.spinner("Running Perception → Mediation …"):
-            # A) Parse constitution (best effort)
-            constitution_obj = {"raw": constitution_text}
-            try:
-                parse_fn, _ = pick_callable(schema, ["parse_constitution_rules", "parse_rules", "from_text"])
-                if parse_fn:
-                    constitution_obj = call_best(parse_fn, text=constitution_text, constitution_text=constitution_text)
-            except Exception:
-                constitution_obj = {"raw": constitution_text}
-
-            # B) Perception (implemented here)
-            perception_packet = gemini_perception(
-                model=model_name,
-                chat=chat_text,
-                constitution_text=constitution_text,
-                context_text=context_text,
+        turn = TurnInputs(chat_text, constitution_text, context_text, perception_mode)
+        # Unchanged inputs would only re-bill the same calls (unless the cache is bypassed on purpose).
+        input_hash = hashlib.sha256(
+            "\0".join([*astuple(turn), model_name, str(one_shot)]).encode("utf-8")
+        ).hexdigest()
+        if not bypass_cache and input_hash == st.session_state.get("last_input_hash") and st.session_state["med"] is not None:
+            st.info("Inputs unchanged since the last run — showing the previous result.")
+        else:
+            with st.spinner("Running Perception → Mediation …"):
+                cached_content = constitution_cache_name(model_name, constitution_text) if use_context_cache else None
+                # A + B) Perception → Mediation, both streamed into the placeholder
+                events, notes, med = run_async_streamed(
+                    lambda on_text: _run_stages(
+                        model_name,
+                        turn,
+                        one_shot=one_shot,
+                        cached_content=cached_content,
+                        bypass_cache=bypass_cache,
+                        on_text=on_text,
+                        service_tier="priority" if priority_tier else SERVICE_TIER_LIVE,
+                    ),
+                    st.empty(),
                 )
-            if isinstance(perception_packet, dict) and "events" in perception_packet:
-                inner = perception_packet["events"]
-                if isinstance(inner, dict) and "events" in inner:
-                    events = inner["events"]
-                    notes = inner.get("notes", {})
-                elif isinstance(inner, list):
-                    events = inner
-                    notes = {}
-                else:
-                    events = []
-                    notes = {}
-            else:
-                events = []
-                notes = {}
-            st.session_state["events"] = events
-            st.session_state["perception_notes"] = notes
-
-
-            # C) Mediation (use your core/mediation.py if it has an entrypoint)
-            m_fn, m_name = pick_callable(mediation, ["run_mediation", "mediate", "mediation", "main"])
-            if not m_fn:
-                # If no entrypoint, fall back to a minimal mediator prompt inside app.py
-                # (Still "only app.py change" and keeps app working)
-                def fallback_mediation(events_json, constitution_text, chat_text):
-                    prompt = f"""
-You are a neutral mediator (DEMO, not therapy).
-Use events + constitution + chat to produce a Fact Receipt. Be evidence-driven and neutral.
-
-CONSTITUTION:
-\"\"\"{constitution_text}\"\"\"
-
-EVENTS JSON:
-\"\"\"{json.dumps(events_json, ensure_ascii=False)}\"\"\"
-
-CHAT:
-\"\"\"{chat_text}\"\"\"
-
-Return STRICT JSON only:
-{{
-  "fact_receipt": {{
-    "evidence_from_chat": [{{"quote":"...","speaker":"A|B|unknown","why_it_matters":"..."}}],
-    "evidence_from_constitution": [{{"rule":"...","why_it_matters":"..."}}]
-  }},
-  "conclusion": {{"type":"memory_mismatch|rule_mismatch|ambiguous","one_sentence_summary":"..."}},
-  "suggestions": {{
-    "for_A": ["..."],
-    "for_B": ["..."],
-    "rule_update_proposal": "..."
-  }},
-  "quiet_warning": {{
-    "should_notify": true,
-    "notify_target": "A|B|both",
-    "message": "..."
-  }}
-}}
-Rules:
-- Evidence quotes MUST be verbatim from chat (or from SpeechEvent.quote).
-- Constitution rules MUST be excerpts from constitution text.
-- STRICT JSON only.
-"""
-                    resp = client.models.generate_content(model=model_name, contents=prompt)
-                    raw = resp.text or ""
-                    out = safe_parse_json(raw)
-                    if not out:
-                        raise ValueError("Fallback mediation returned invalid JSON.")
-                    return out, "fallback_mediation"
-
-                med, m_name = fallback_mediation(events, constitution_text, chat_text)
-            else:
-                med = call_best(
-                    m_fn,
-                    api_key=api_key,
-                    model=model_name,
-                    constitution=constitution_obj,
-                    constitution_text=constitution_text,
-                    events=events,
-                    chat=chat_text,
-                    chat_text=chat_text,
-                    context=context_text,
-                    context_text=context_text,
+                st.session_state["events"] = events
+                st.session_state["perception_notes"] = notes
+                st.session_state["med"] = med
+
+                # C) Memory: ledger / vibe / tiers (derived data only)
+                tension_level, _ = extract_tension_level({"events": events})
+                memory.add_run_artifacts(
+                    ts=memory.utc_now_iso(),
+                    events={"events": events, "notes": notes},
+                    result=med,
+                    ledger_48h=st.session_state.ledger_48h,
+                    vibe_history=st.session_state.vibe_history,
+                    tier1_events_48h=st.session_state.tier1_events_48h,
+                    tier2_summaries_30d=st.session_state.tier2_summaries_30d,
+                    tier3_embeddings=st.session_state.tier3_embeddings,
+                    tension_level=tension_level,
                 )
+                # Serialized once here; the ledger tab just reads it on every rerun.
+                st.session_state["latest_ledger"] = shallow_asdict(st.session_state.ledger_48h[0])
+                st.session_state.vibe_series.append(VIBE_LEVEL_SCORE.get(tension_level, 0))
+                memory.apply_retention_policy(
+                    ledger_48h=st.session_state.ledger_48h,
+                    vibe_history=st.session_state.vibe_history,
+                    tier1_events_48h=st.session_state.tier1_events_48h,
+                    tier2_summaries_30d=st.session_state.tier2_summaries_30d,
+                    tier3_embeddings=st.session_state.tier3_embeddings,
+                )
+                st.session_state["last_input_hash"] = input_hash
 
-            st.session_state["med"] = med
-
-            # D) Memory (optional)
-            ledger = vibe = decay = None
-            try:
-                upsert_fn, _ = pick_callable(memory, ["upsert_receipt", "store_receipt"])
-                if upsert_fn:
-                    ledger = call_best(upsert_fn, receipt=med, med=med, events=events, constitution=constitution_obj)
-            except Exception:
-                ledger = None
-
-            try:
-                vibe_fn, _ = pick_callable(memory, ["compute_vibe"])
-                if vibe_fn:
-                    vibe = call_best(vibe_fn, ledger=ledger, state=ledger, window_days=30)
-            except Exception:
-                vibe = None
-
-            try:
-                decay_fn, _ = pick_callable(memory, ["apply_decay", "apply_decay_policy"])
-                if decay_fn:
-                    decay = call_best(decay_fn, ledger=ledger, state=ledger)
-            except Exception:
-                decay = None
-
-            st.session_state["ledger"] = ledger if ledger is not None else {"note": "ledger not implemented (fallback)", "latest": med}
-            st.session_state["vibe"] = vibe if vibe is not None else {"note": "vibe not implemented (fallback)", "window_days": 30}
-            st.session_state["decay"] = decay if decay is not None else {
-                "note": "decay not implemented (fallback)",
-                "tier_1_raw_metadata_48h": True,
-                "tier_2_summaries_30d": True,
-                "tier_3_embeddings_long_term": True,
-            }
-
-        st.success("Done.")
-        st.rerun()
+            st.success("Done.")
+            st.rerun()
 
 
 with right:
-    tab1, tab2, tab3, tab4, tab5 = st.tabs(
-        ["Perception Events", "Fact Ledger (48h)", "Vibe Score (30d)", "Memory & Decay", "Export"]
+    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(
+        ["Perception Events", "Fact Ledger (48h)", "Vibe Score (30d)", "Memory & Decay", "Export", "Batch eval"]
     )
 
     with tab1:
@@ -330,33 +774,113 @@ with right:
         if st.session_state["med"] is None:
             st.info("Run HALO loop to generate mediation receipt.")
         else:
-            st.json(st.session_state["med"])
+            med = st.session_state["med"]
+            st.markdown(session_memo("receipt_md", id(med), lambda: receipt_markdown(med)))
+            with st.expander("Mediation JSON", expanded=False):
+                st.json(med)
         st.divider()
-        st.caption("Ledger state (optional)")
-        st.json(st.session_state["ledger"])
+        st.caption(f"Ledger: {len(st.session_state.ledger_48h)} entries in the last 48h (latest shown)")
+        if st.session_state["latest_ledger"] is not None:
+            st.json(st.session_state["latest_ledger"])
 
     with tab3:
         st.subheader("Vibe Score (30d)")
-        st.json(st.session_state["vibe"])
+        if st.session_state["events"] is not None:
+            level, notify_hint = _cached_tension_level({"events": st.session_state["events"]})
+            st.metric("Current tension", level, help="Notify hint: yes" if notify_hint else "Notify hint: no")
+        if st.session_state.vibe_series:
+            st.line_chart(list(st.session_state.vibe_series))
+            st.caption("Tension per run (last 60): 1 = low, 2 = rising, 3 = high, 0 = unknown")
+        else:
+            st.info("Run HALO loop to build the vibe trend.")
 
     with tab4:
         st.subheader("Memory & Decay")
-        st.json(st.session_state["decay"])
+        st.caption("Tier 1: structured events (48h) · Tier 2: summaries (30d) · Tier 3: embedding ids (long-term)")
+        for title, name, limit in [
+            ("Tier 1 — latest events", "tier1_events_48h", 2),
+            ("Tier 2 — summaries", "tier2_summaries_30d", 5),
+            ("Tier 3 — embeddings", "tier3_embeddings", 5),
+        ]:
+            buf = st.session_state[name]
+            st.markdown(f"**{title}**")
+            # Serialized (not asdict): Tier 1 records nest typed event dataclasses, and ts_epoch stays out.
+            st.json(session_memo(name, buffer_key(buf), lambda: dumps_pretty(list(islice(buf, limit))).decode("utf-8")))
 
     with tab5:
         st.subheader("Export")
-        bundle = {
-            "events": st.session_state["events"],
-            "mediation": st.session_state["med"],
-            "ledger": st.session_state["ledger"],
-            "vibe": st.session_state["vibe"],
-            "decay": st.session_state["decay"],
-        }
+        payload_key = tuple(
+            buffer_key(st.session_state[k])
+            for k in ["ledger_48h", "vibe_history", "tier2_summaries_30d", "tier3_embeddings"]
+        )
+        # Serialized once per (run, buffer state); the download and the preview share the bytes.
+        bundle_json = session_memo(
+            "bundle_json",
+            (id(st.session_state["med"]), payload_key),
+            lambda: dumps_pretty(
+                {
+                    "events": st.session_state["events"],
+                    "mediation": st.session_state["med"],
+                    **memory.export_payload(
+                        ledger_48h=st.session_state.ledger_48h,
+                        vibe_history=st.session_state.vibe_history,
+                        tier2_summaries_30d=st.session_state.tier2_summaries_30d,
+                        tier3_embeddings=st.session_state.tier3_embeddings,
+                        as_dicts=False,
+                    ),
+                }
+            ),
+        )
         st.download_button(
             "⬇️ Download JSON bundle",
-            data=json.dumps(bundle, ensure_ascii=False, indent=2),
+            data=bundle_json,
             file_name="halo_bundle.json",
             mime="application/json",
             use_container_width=True,
         )
-        st.code(json.dumps(bundle, ensure_ascii=False, indent=2), language="json")
+        # Expander children are built and sent even when collapsed, so the preview is opt-in.
+        if st.toggle("Preview JSON", value=False):
+            st.json(bundle_json.decode("utf-8"))
+
+    with tab6:
+        st.subheader("Batch eval")
+        st.caption("Runs perception + mediation for every transcript.")
+        use_batch_api = st.toggle(
+            "Use Gemini Batch API",
+            value=True,
+            help="Discounted but may take minutes. Off: live calls, several transcripts in flight at once.",
+        )
+        uploaded = st.file_uploader("Transcripts CSV (one chat per row; a 'chat' header picks the column)", type="csv")
+        if uploaded is not None:
+            try:
+                chats = read_chat_csv(uploaded)
+            except UnicodeDecodeError:
+                st.error("Could not read the CSV: save it as UTF-8 and upload it again.")
+                chats = []
+            st.caption(f"{len(chats)} transcripts")
+            running = st.session_state["batch_job"] is not None
+            if st.button("Submit batch", disabled=not chats or running, use_container_width=True):
+                if use_batch_api:
+                    st.session_state["batch_rows"] = None
+                    try:
+                        track_batch(start_batch(model_name, chats, constitution_text, context_text, perception_mode))
+                    except Exception as e:  # SDK / API errors from the submit
+                        st.error(f"Batch submit failed: {e}")
+                else:
+                    with st.spinner("Running transcripts …"):
+                        st.session_state["batch_rows"] = run_async(
+                            run_many(
+                                model_name, chats, constitution_text, context_text, perception_mode, bypass_cache
+                            )
+                        )
+        # The job is kept in session_state (and by id in the URL), so polling resumes across
+        # reruns, after Stop, and after a page refresh.
+        if st.session_state["batch_job"] is None and "batch" in st.query_params:
+            st.session_state["batch_job"] = batch_registry().get(st.query_params["batch"])
+        if st.session_state["batch_job"] is not None:
+            batch_status(st.session_state["batch_job"])
+        batch_error = st.session_state.pop("batch_error", None)
+        if batch_error:
+            st.error(batch_error)
+        if st.session_state["batch_rows"] is not None:
+            st.dataframe(st.session_state["batch_rows"], use_container_width=True)
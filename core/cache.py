@@ -0,0 +1,117 @@
+# response cache (model, prompt) -> text: in-process LRU in front of an on-disk store
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+CACHE_DIR = ".halo_cache"
+# Responses quote the chat verbatim, so nothing outlives the 48h Tier 1 window on disk.
+MAX_EXPIRE_S = 48 * 3600
+DEFAULT_EXPIRE_S = MAX_EXPIRE_S
+MEMO_MAX = 256
+DISK_MAX = 500  # entries kept on disk; the soonest-expiring go first past this
+SWEEP_EVERY = 50  # writes between disk sweeps (the first write in a process also sweeps)
+
+_writes = 0
+
+# (cache_dir, key) -> (expires_at, text); survives Streamlit reruns since modules load once per process.
+_memo: "OrderedDict[Tuple[str, str], Tuple[float, str]]" = OrderedDict()
+
+
+def cache_key(model: str, prompt: str, *extra: str) -> str:
+    # extra: inputs that shaped the response but are not in the prompt text (e.g. cached context)
+    payload = "\0".join((model, prompt, *extra))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _path(key: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, key[:2], f"{key}.json")
+
+
+def _remember(cache_dir: str, key: str, expires_at: float, text: str) -> None:
+    _memo[(cache_dir, key)] = (expires_at, text)
+    _memo.move_to_end((cache_dir, key))
+    while len(_memo) > MEMO_MAX:
+        _memo.popitem(last=False)
+
+
+def get(key: str, cache_dir: str = CACHE_DIR) -> Optional[str]:
+    now = time.time()
+    hit = _memo.get((cache_dir, key))
+    if hit is not None:
+        if hit[0] >= now:
+            _memo.move_to_end((cache_dir, key))
+            return hit[1]
+        del _memo[(cache_dir, key)]
+
+    path = _path(key, cache_dir)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+    expires_at = record.get("expires_at", 0)
+    if expires_at < now:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+    text = record.get("text")
+    if text is not None:
+        _remember(cache_dir, key, expires_at, text)
+    return text
+
+
+def set(key: str, text: str, expire: int = DEFAULT_EXPIRE_S, cache_dir: str = CACHE_DIR) -> None:
+    global _writes
+    if _writes % SWEEP_EVERY == 0:
+        sweep(cache_dir)
+    _writes += 1
+    expires_at = time.time() + min(expire, MAX_EXPIRE_S)
+    _remember(cache_dir, key, expires_at, text)
+    path = _path(key, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"expires_at": expires_at, "text": text}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def delete(key: str, cache_dir: str = CACHE_DIR) -> None:
+    _memo.pop((cache_dir, key), None)
+    try:
+        os.remove(_path(key, cache_dir))
+    except OSError:
+        pass
+
+
+def sweep(cache_dir: str = CACHE_DIR, max_entries: int = DISK_MAX) -> None:
+    # Expired files are otherwise only removed when their own key is read again.
+    now = time.time()
+    live = []
+    for root, _dirs, files in os.walk(cache_dir):
+        for name in files:
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    expires_at = json.load(f).get("expires_at", 0)
+            except (OSError, ValueError):
+                expires_at = 0
+            if expires_at < now:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            else:
+                live.append((expires_at, path))
+    live.sort()
+    for _expires_at, path in live[: max(0, len(live) - max_entries)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
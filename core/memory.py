@@ -1,47 +1,57 @@
 # ledger / vibe / decay
 import hashlib
-import json
-from dataclasses import asdict
-from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional
-
-from .schema import LedgerEntry, VibePoint, Tier1Record, Tier2Summary, Tier3Embedding
+import sys
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Deque, Dict, Iterable, Optional
+
+from .schema import (
+    CONCLUSION_TYPES,
+    TENSION_LEVELS,
+    LedgerEntry,
+    Tier1Record,
+    Tier2Summary,
+    Tier3Embedding,
+    VibePoint,
+    parse_ts,
+    shallow_asdict,
+    typed_events,
+)
+
+# Buffer caps (deque maxlen): appendleft/append evict the oldest entry in O(1).
+LEDGER_CAP = 200
+TIER1_CAP = 200
+VIBE_CAP = 2000
+TIER2_CAP = 500
+TIER3_CAP = 2000
+
+
+def new_buffers() -> Dict[str, Deque[Any]]:
+    return {
+        "ledger_48h": deque(maxlen=LEDGER_CAP),
+        "vibe_history": deque(maxlen=VIBE_CAP),
+        "tier1_events_48h": deque(maxlen=TIER1_CAP),
+        "tier2_summaries_30d": deque(maxlen=TIER2_CAP),
+        "tier3_embeddings": deque(maxlen=TIER3_CAP),
+    }
 
 
 def utc_now_iso() -> str:
-    return datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
-
-
-def make_fake_embedding_id(payload: str) -> str:
-    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:12]
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
 
-def prune_by_hours(items: List[Any], hours: int, ts_attr: str = "ts_utc", keep_max: int = 5000) -> List[Any]:
-    cutoff = datetime.utcnow() - timedelta(hours=hours)
-    kept = []
-    for it in items:
-        ts = getattr(it, ts_attr, "")
-        try:
-            dt = datetime.fromisoformat(ts.replace("Z", ""))
-            if dt >= cutoff:
-                kept.append(it)
-        except Exception:
-            kept.append(it)
-    return kept[:keep_max]
+def make_fake_embedding_id(payload: bytes) -> str:
+    return hashlib.blake2b(payload, digest_size=6).hexdigest()
 
 
-def prune_by_days(items: List[Any], days: int, ts_attr: str = "ts_utc", keep_max: int = 5000) -> List[Any]:
-    cutoff = datetime.utcnow() - timedelta(days=days)
-    kept = []
-    for it in items:
-        ts = getattr(it, ts_attr, "")
-        try:
-            dt = datetime.fromisoformat(ts.replace("Z", ""))
-            if dt >= cutoff:
-                kept.append(it)
-        except Exception:
-            kept.append(it)
-    return kept[:keep_max]
+def prune_before(buf: Deque[Any], cutoff: float, newest_first: bool = True) -> None:
+    # Buffers are time-ordered, so expired entries sit at one end: pop them off, O(expired).
+    if newest_first:
+        while buf and buf[-1].ts_epoch < cutoff:
+            buf.pop()
+    else:
+        while buf and buf[0].ts_epoch < cutoff:
+            buf.popleft()
 
 
 def add_run_artifacts(
@@ -49,29 +59,45 @@ def add_run_artifacts(
     ts: str,
     events: Dict[str, Any],
     result: Dict[str, Any],
-    ledger_48h: List[LedgerEntry],
-    vibe_history: List[VibePoint],
-    tier1_events_48h: List[Tier1Record],
-    tier2_summaries_30d: List[Tier2Summary],
-    tier3_embeddings: List[Tier3Embedding],
+    ledger_48h: Deque[LedgerEntry],
+    vibe_history: Deque[VibePoint],
+    tier1_events_48h: Deque[Tier1Record],
+    tier2_summaries_30d: Deque[Tier2Summary],
+    tier3_embeddings: Deque[Tier3Embedding],
     tension_level: str,
 ) -> None:
+    ts_epoch = parse_ts(ts)
+
     # Ledger (derived-only)
     entry = LedgerEntry(
         ts_utc=ts,
         fact_receipt=result.get("fact_receipt", {}),
         conclusion=result.get("conclusion", {}),
         intervention_plan=result.get("intervention_plan", {}),
-        privacy_note="Stored derived evidence only (quotes + constitution excerpts). No raw audio/video."
+        privacy_note="Stored derived evidence only (quotes + constitution excerpts). No raw audio/video.",
+        ts_epoch=ts_epoch,
     )
-    ledger_48h.insert(0, entry)
+    ledger_48h.appendleft(entry)
 
     # Vibe
     notify = bool(result.get("intervention_plan", {}).get("should_notify", False))
-    vibe_history.append(VibePoint(ts_utc=ts, level=tension_level, notify=notify))
+    # Literal values are interned so every retained record shares one string per level / type.
+    level = sys.intern(tension_level) if tension_level in TENSION_LEVELS else "unknown"
+    vibe_history.append(VibePoint(ts_utc=ts, level=level, notify=notify, ts_epoch=ts_epoch))
 
     # Tier 1 (events)
-    tier1_events_48h.insert(0, Tier1Record(ts_utc=ts, events=events))
+    speech, sensor, tension, rules = typed_events(events.get("events", []))
+    tier1_events_48h.appendleft(
+        Tier1Record(
+            ts_utc=ts,
+            speech=speech,
+            sensor=sensor,
+            tension=tension,
+            rules=rules,
+            notes=events.get("notes", {}),
+            ts_epoch=ts_epoch,
+        )
+    )
 
     # Tier 2 (summary)
     con = result.get("conclusion", {})
@@ -80,17 +106,18 @@ def add_run_artifacts(
         f"{con.get('type','unknown')}: {con.get('one_sentence_summary','')}"
         f" | notify={plan.get('should_notify', False)} via {plan.get('channel','none')}"
     )
+    ctype = con.get("type")
     t2 = Tier2Summary(
         ts_utc=ts,
         summary=summary_text,
-        conclusion_type=con.get("type", "unknown")
+        conclusion_type=sys.intern(ctype) if isinstance(ctype, str) and ctype in CONCLUSION_TYPES else "unknown",
+        ts_epoch=ts_epoch,
     )
-    tier2_summaries_30d.insert(0, t2)
+    tier2_summaries_30d.appendleft(t2)
 
     # Tier 3 (fake embedding id)
-    payload = json.dumps(asdict(t2), ensure_ascii=False)
-    tier3_embeddings.insert(
-        0,
+    payload = f"{t2.ts_utc}|{t2.conclusion_type}|{t2.summary}".encode("utf-8")
+    tier3_embeddings.appendleft(
         Tier3Embedding(
             ts_utc=ts,
             embedding_id=make_fake_embedding_id(payload),
@@ -101,38 +128,43 @@ def add_run_artifacts(
 
 def apply_retention_policy(
     *,
-    ledger_48h: List[LedgerEntry],
-    vibe_history: List[VibePoint],
-    tier1_events_48h: List[Tier1Record],
-    tier2_summaries_30d: List[Tier2Summary],
-    tier3_embeddings: List[Tier3Embedding],
+    ledger_48h: Deque[LedgerEntry],
+    vibe_history: Deque[VibePoint],
+    tier1_events_48h: Deque[Tier1Record],
+    tier2_summaries_30d: Deque[Tier2Summary],
+    tier3_embeddings: Deque[Tier3Embedding],
 ) -> None:
-    # 48h for ledger + tier1
-    ledger_48h[:] = prune_by_hours(ledger_48h, hours=48, keep_max=200)
-    tier1_events_48h[:] = prune_by_hours(tier1_events_48h, hours=48, keep_max=200)
+    # Size caps are enforced by each deque's maxlen; only the time windows are swept here.
+    now = datetime.now(timezone.utc)
+    cutoff_48h = (now - timedelta(hours=48)).timestamp()
+    cutoff_30d = (now - timedelta(days=30)).timestamp()
+
+    # 48h for ledger + tier1 (newest first)
+    prune_before(ledger_48h, cutoff_48h)
+    prune_before(tier1_events_48h, cutoff_48h)
 
-    # 30d for vibe + tier2
-    vibe_history[:] = prune_by_days(vibe_history, days=30, keep_max=2000)
-    tier2_summaries_30d[:] = prune_by_days(tier2_summaries_30d, days=30, keep_max=500)
+    # 30d for vibe (oldest first) + tier2 (newest first)
+    prune_before(vibe_history, cutoff_30d, newest_first=False)
+    prune_before(tier2_summaries_30d, cutoff_30d)
 
-    # Tier3 long-term: cap
-    if len(tier3_embeddings) > 2000:
-        del tier3_embeddings[2000:]
+    # Tier3 long-term: no time window, capped by TIER3_CAP only
 
 
 def export_payload(
     *,
-    ledger_48h: List[LedgerEntry],
-    vibe_history: List[VibePoint],
-    tier2_summaries_30d: List[Tier2Summary],
-    tier3_embeddings: List[Tier3Embedding],
+    ledger_48h: Iterable[LedgerEntry],
+    vibe_history: Iterable[VibePoint],
+    tier2_summaries_30d: Iterable[Tier2Summary],
+    tier3_embeddings: Iterable[Tier3Embedding],
+    as_dicts: bool = True,
 ) -> Dict[str, Any]:
-    from dataclasses import asdict
+    # as_dicts=False keeps the dataclass records for a serializer that applies shallow_asdict itself.
+    conv = shallow_asdict if as_dicts else (lambda x: x)
     return {
-        "ledger_48h": [asdict(e) for e in ledger_48h],
-        "vibe_history_30d": [asdict(v) for v in vibe_history],
-        "tier2_summaries_30d": [asdict(s) for s in tier2_summaries_30d],
-        "tier3_embeddings": [asdict(e) for e in tier3_embeddings],
+        "ledger_48h": [conv(e) for e in ledger_48h],
+        "vibe_history_30d": [conv(v) for v in vibe_history],
+        "tier2_summaries_30d": [conv(s) for s in tier2_summaries_30d],
+        "tier3_embeddings": [conv(e) for e in tier3_embeddings],
         "privacy_statement": (
             "This demo stores derived events and receipts. "
             "It does not store raw audio/video or face identity."
@@ -1,7 +1,17 @@
 # Stage 1: mock events 
 import re
 import json
-from typing import Any, Dict, Optional, Tuple, List
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:  # optional: stdlib json fallback
+    _loads = json.loads
+
+_JSON_BRACE_RE = re.compile(r"\{.*\}", re.S)
 
 
 def safe_parse_json(text: str) -> Optional[Dict[str, Any]]:
@@ -9,24 +19,55 @@ def safe_parse_json(text: str) -> Optional[Dict[str, Any]]:
         return None
     text = text.strip()
     try:
-        return json.loads(text)
+        return _loads(text)
     except Exception:
-        m = re.search(r"\{.*\}", text, re.S)
+        m = _JSON_BRACE_RE.search(text)
         if m:
             try:
-                return json.loads(m.group(0))
+                return _loads(m.group(0))
             except Exception:
                 return None
         return None
 
 
-def parse_constitution_rules(constitution: str) -> List[str]:
-    rules = []
-    for line in constitution.splitlines():
-        line = line.strip()
-        if line.startswith("- "):
-            rules.append(line[2:].strip())
-    return rules
+class JsonCloseDetector:
+    """Incrementally tracks brace depth of streamed JSON text.
+
+    feed() returns True once the first top-level object has closed, so a caller
+    can stop reading a stream without waiting for trailing chunks.
+    """
+
+    def __init__(self) -> None:
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, text: str) -> bool:
+        for ch in text:
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch == "{":
+                self.depth += 1
+                self.started = True
+            elif ch == "}":
+                self.depth -= 1
+                if self.started and self.depth == 0:
+                    return True
+        return False
+
+
+@lru_cache(maxsize=32)
+def parse_constitution_rules(constitution: str) -> Tuple[str, ...]:
+    # Called on every Streamlit rerun; an unchanged constitution is a single cache lookup.
+    return tuple(line[2:].strip() for line in map(str.strip, constitution.splitlines()) if line.startswith("- "))
 
 
 def extract_tension_level(events_dict: Dict[str, Any]) -> Tuple[str, bool]:
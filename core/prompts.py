@@ -1,138 +1,290 @@
 # Gemini prompt
 import json
+from functools import lru_cache
 from typing import Any, Dict
 
+from .schema import TurnInputs
 
-def sensor_prompt(chat: str, constitution: str, context_notes: str, mode: str) -> str:
-    return f"""
-You are the Perception Layer of an ambient home AI ("HALO").
-Your job: convert chat + constitution + context into structured events a real system could produce.
+try:
+    import orjson
 
-This is a DEMO. Do NOT invent sensitive personal data (no names, addresses, health diagnoses).
-Do not produce therapy. Be neutral.
+    def _dumps(obj: Any) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+except ImportError:  # optional: stdlib json fallback, same compact output
 
-Constitution (shared rules/values):
-\"\"\"{constitution}\"\"\"
+    def _dumps(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
 
-Optional context (home setup / devices / scenario):
-\"\"\"{context_notes}\"\"\"
+# Stands in for the constitution text when it is supplied as Gemini cached context.
+CONSTITUTION_IN_CACHE = "(see the Household Constitution in the cached context)"
 
-Chat history:
-\"\"\"{chat}\"\"\"
+# Smallest block (in tokens) each provider accepts for explicit prompt caching.
+CACHE_MIN_TOKENS = {"gemini": 1024, "anthropic": 1024, "openai": 0}
 
-Output STRICT JSON only, schema:
-{{
+
+@lru_cache(maxsize=32)
+def estimate_tokens(text: str) -> int:
+    # ~4 UTF-8 bytes per token for English prose; close enough for a size gate, no tokenizer needed.
+    return len(text.encode("utf-8")) // 4
+
+
+def constitution_is_cacheable(constitution: str, provider: str = "gemini") -> bool:
+    return estimate_tokens(constitution) >= CACHE_MIN_TOKENS[provider]
+
+
+_SENSOR_SCHEMA = """{
   "events": [
-    {{
+    {
       "type": "SpeechEvent",
       "ts_hint": "e.g., 7:00pm or unknown",
       "speaker": "A|B|unknown",
       "quote": "verbatim quote from chat",
-      "thought_signature": {{
+      "thought_signature": {
         "intent": "request|complaint|defense|clarify|boundary|repair_attempt|other",
         "topic_tags": ["chores","time","tone","fairness","respect","money","family","other"],
         "implicit_need": "short neutral phrase"
-      }}
-    }},
-    {{
+      }
+    },
+    {
       "type": "SensorEvent",
       "source": "watch|camera|microphone|environment",
       "signal": "hrv_spike|volume_spike|door_slam|cabinet_slam|silence_withdrawal|other",
       "severity": 0,
       "explanation": "1 neutral sentence",
       "confidence": 0.0
-    }},
-    {{
+    },
+    {
       "type": "TensionSignalEvent",
       "level": "low|rising|high",
       "signals": ["absolute_language","blame","sarcasm","rapid_escalation","exclamation","questioning","interruptions"],
       "explanation": "1 neutral sentence"
-    }},
-    {{
+    },
+    {
       "type": "RuleContextEvent",
       "matched_rules": ["short excerpt rule 1", "short excerpt rule 2"],
       "why_these_rules": "1 sentence"
-    }}
+    }
   ],
-  "notes": {{
+  "notes": {
     "what_is_simulated": "1 sentence",
     "privacy_statement": "1 sentence: store only derived events, not raw media"
-  }}
-}}
+  }
+}"""
 
-Rules:
-- Include 3-10 SpeechEvent items. Quotes MUST appear in chat.
+_SENSOR_RULES = """- Include 3-10 SpeechEvent items. Quotes MUST appear in chat.
 - Include 0-5 SensorEvent items.
 - Include exactly 1 TensionSignalEvent.
 - Include 1 RuleContextEvent that references the constitution text (short excerpts).
 - If mode is "conservative": keep SensorEvent minimal and use 'confidence' lower.
 - If mode is "demo_mock": you may add plausible SensorEvent to enrich the scene, but never claim certainty.
-- Output JSON only. No markdown. No extra text.
-
-Mode: {mode}
-"""
-
-
-def mediator_prompt(events_json: Dict[str, Any], constitution: str) -> str:
-    events_text = json.dumps(events_json, ensure_ascii=False)
-    return f"""
-You are the Mediator / Reasoning Engine of HALO (ambient home AI).
-Goal: reduce "he said / she said" by producing an objective, evidence-based receipt.
-This is NOT therapy. No diagnosis. No moral judgment.
-
-Constitution (shared rules/values):
-\"\"\"{constitution}\"\"\"
-
-Perception events (structured, simulated):
-\"\"\"{events_text}\"\"\"
+- Output JSON only. No markdown. No extra text."""
 
-Return STRICT JSON only with this schema:
-{{
-  "fact_receipt": {{
+_MEDIATOR_SCHEMA = """{
+  "fact_receipt": {
     "evidence_from_chat": [
-      {{
+      {
         "quote": "verbatim from SpeechEvent.quote",
         "speaker": "A|B|unknown",
         "why_it_matters": "short neutral explanation"
-      }}
+      }
     ],
     "evidence_from_constitution": [
-      {{
+      {
         "rule_excerpt": "short excerpt from constitution",
         "why_it_matters": "short"
-      }}
+      }
     ],
     "time_window": "e.g., last 10 minutes / unknown"
-  }},
-  "conclusion": {{
+  },
+  "conclusion": {
     "type": "memory_mismatch|rule_mismatch|ambiguous",
     "one_sentence_summary": "neutral",
     "confidence": 0.0
-  }},
-  "intervention_plan": {{
+  },
+  "intervention_plan": {
     "should_notify": true,
     "notify_target": "A|B|both",
     "channel": "watch_haptic|speaker_voice|phone_notification|none",
     "message": "1-2 sentence nudge",
-    "circuit_breaker": {{
+    "circuit_breaker": {
       "recommend_pause_minutes": 0,
       "why_pause": "short"
-    }}
-  }},
-  "post_conflict_debrief": {{
+    }
+  },
+  "post_conflict_debrief": {
     "for_A": ["2-4 concrete actions, respectful, with example phrases"],
     "for_B": ["2-4 concrete actions, respectful, with example phrases"],
     "rule_update_proposal": "one updated rule in plain language"
-  }},
-  "privacy_and_storage": {{
+  },
+  "privacy_and_storage": {
     "store_policy": "Tier1 48h events, Tier2 30d summaries, Tier3 embeddings",
     "what_is_not_stored": "no raw audio/video, no face identity"
-  }}
-}}
+  }
+}"""
 
-Hard constraints:
-- Evidence quotes MUST be from SpeechEvent.quote.
+# Replaces the inline layout when the same schema is sent as response_schema.
+_SCHEMA_ATTACHED = "(the response schema attached to this request)"
+
+_MEDIATOR_RULES = """- Evidence quotes MUST be from SpeechEvent.quote.
 - Rule excerpts MUST be taken from the constitution text (short excerpts).
 - Do NOT invent facts not supported by events.
-- Output JSON only. No markdown. No extra text.
+- Output JSON only. No markdown. No extra text."""
+
+
+def _compact(schema_text: str) -> str:
+    # Pretty-printed above for reading; sent minified, since indentation whitespace costs input tokens.
+    return json.dumps(json.loads(schema_text), ensure_ascii=False, separators=(",", ":"))
+
+
+_SENSOR_SCHEMA_JSON = _compact(_SENSOR_SCHEMA)
+_MEDIATOR_SCHEMA_JSON = _compact(_MEDIATOR_SCHEMA)
+
+
+# Static prompt text is assembled once at import; builders only join the dynamic slots in.
+# Each prompt opens with its static block (role, schema, rules) so repeated calls share a
+# verbatim prefix for Gemini's implicit prompt caching; constitution, context and mode follow,
+# and the chat (the only per-turn input) comes last.
+_CONSTITUTION_SLOT = '''
+Constitution (shared rules/values):
+"""'''
+
+_CONTEXT_SLOT = '''"""
+
+Optional context (home setup / devices / scenario):
+"""'''
+
+_MODE_SLOT = '''"""
+
+Mode: '''
+
+_CHAT_SLOT = '''
+
+Chat history:
+"""'''
+
+
+def _sensor_head(schema: str) -> str:
+    return f"""
+You are the Perception Layer of an ambient home AI ("HALO").
+Your job: convert chat + constitution + context into structured events a real system could produce.
+
+This is a DEMO. Do NOT invent sensitive personal data (no names, addresses, health diagnoses).
+Do not produce therapy. Be neutral.
+
+Output STRICT JSON only, schema:
+{schema}
+
+Rules:
+{_SENSOR_RULES}
+"""
+
+
+_SENSOR_HEAD = {True: _sensor_head(_SENSOR_SCHEMA_JSON), False: _sensor_head(_SCHEMA_ATTACHED)}
+
+
+def _mediator_head(schema: str) -> str:
+    return f"""
+You are the Mediator / Reasoning Engine of HALO (ambient home AI).
+Goal: reduce "he said / she said" by producing an objective, evidence-based receipt.
+This is NOT therapy. No diagnosis. No moral judgment.
+
+Return STRICT JSON only with this schema:
+{schema}
+
+Hard constraints:
+{_MEDIATOR_RULES}
+"""
+
+
+_MEDIATOR_HEAD = {True: _mediator_head(_MEDIATOR_SCHEMA_JSON), False: _mediator_head(_SCHEMA_ATTACHED)}
+
+_EVENTS_SLOT = '''"""
+
+Perception events (structured, simulated):
+"""'''
+
+
+def _combined_head(schema: str, mediation_schema: str) -> str:
+    return f"""
+You are HALO (ambient home AI). Run BOTH stages in a single pass:
+Stage 1 (Perception Layer): convert chat + constitution + context into structured events.
+Stage 2 (Mediator / Reasoning Engine): reason over YOUR Stage 1 events + constitution and produce an
+objective, evidence-based receipt that reduces "he said / she said".
+
+This is a DEMO. Do NOT invent sensitive personal data (no names, addresses, health diagnoses).
+This is NOT therapy. No diagnosis. No moral judgment. Be neutral.
+
+Output STRICT JSON only, schema:
+{schema}
+
+Stage 1 rules:
+{_SENSOR_RULES}
+{mediation_schema}
+Stage 2 hard constraints:
+{_MEDIATOR_RULES}
 """
+
+
+_COMBINED_HEAD = {
+    True: _combined_head(
+        f"""{{
+  "events": <Stage 1 object>,
+  "mediation": <Stage 2 object>
+}}
+
+Stage 1 object schema:
+{_SENSOR_SCHEMA_JSON}""",
+        f"""
+Stage 2 object schema:
+{_MEDIATOR_SCHEMA_JSON}
+""",
+    ),
+    False: _combined_head(_SCHEMA_ATTACHED, ""),
+}
+
+
+@lru_cache(maxsize=32)
+def _sensor_static(constitution: str, context_notes: str, mode: str, inline_schema: bool) -> str:
+    # Everything but the chat; unchanged settings across turns reuse the same string.
+    return "".join(
+        (
+            _SENSOR_HEAD[inline_schema],
+            _CONSTITUTION_SLOT, constitution,
+            _CONTEXT_SLOT, context_notes,
+            _MODE_SLOT, mode,
+            _CHAT_SLOT,
+        )
+    )
+
+
+@lru_cache(maxsize=32)
+def _combined_static(constitution: str, context_notes: str, mode: str, inline_schema: bool) -> str:
+    return "".join(
+        (
+            _COMBINED_HEAD[inline_schema],
+            _CONSTITUTION_SLOT, constitution,
+            _CONTEXT_SLOT, context_notes,
+            _MODE_SLOT, mode,
+            _CHAT_SLOT,
+        )
+    )
+
+
+def sensor_prompt(turn: TurnInputs, inline_schema: bool = True) -> str:
+    return _sensor_static(turn.constitution, turn.context_notes, turn.mode, inline_schema) + turn.chat + '"""\n'
+
+
+def mediator_prompt(events_json: Dict[str, Any], turn: TurnInputs, inline_schema: bool = True) -> str:
+    # Only the constitution is read from the turn: the mediator sees the events, not the raw chat.
+    events_text = _dumps(events_json)
+    return "".join(
+        (
+            _MEDIATOR_HEAD[inline_schema],
+            _CONSTITUTION_SLOT, turn.constitution,
+            _EVENTS_SLOT, events_text, '"""\n',
+        )
+    )
+
+
+def combined_prompt(turn: TurnInputs, inline_schema: bool = True) -> str:
+    return _combined_static(turn.constitution, turn.context_notes, turn.mode, inline_schema) + turn.chat + '"""\n'
@@ -1,39 +1,369 @@
 # Event Abstraction Layer
-from dataclasses import dataclass
-from typing import Any, Dict
+import sys
+from datetime import datetime
+from dataclasses import dataclass, field, fields
+from typing import Any, Callable, Dict, Iterable, List, Literal, Optional, Tuple, get_args
 
+try:
+    import fastjsonschema
+except ImportError:  # optional: top-level required-key check instead
+    fastjsonschema = None
 
-@dataclass
+# Enumerated values shared by the records and the Gemini response schemas below;
+# "unknown" is the local fallback and is not offered to the model.
+TensionLevel = Literal["low", "rising", "high", "unknown"]
+ConclusionType = Literal["memory_mismatch", "rule_mismatch", "ambiguous", "unknown"]
+TENSION_LEVELS = frozenset(get_args(TensionLevel))
+CONCLUSION_TYPES = frozenset(get_args(ConclusionType))
+
+
+def parse_ts(ts: str) -> float:
+    # ISO-8601 UTC stamp -> epoch seconds; unparseable stamps are never expired.
+    try:
+        return datetime.fromisoformat(ts.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return float("inf")
+
+
+# Field metadata for bookkeeping fields that stay out of rendered / exported records.
+_INTERNAL = {"export": False}
+
+
+def _stamp(record: Any) -> None:
+    # A record built without ts_epoch gets it from ts_utc, never a 1970 default.
+    if record.ts_epoch is None:
+        object.__setattr__(record, "ts_epoch", parse_ts(record.ts_utc))
+
+
+@dataclass(slots=True, frozen=True)
 class LedgerEntry:
     ts_utc: str
     fact_receipt: Dict[str, Any]
     conclusion: Dict[str, Any]
     intervention_plan: Dict[str, Any]
     privacy_note: str
+    ts_epoch: Optional[float] = field(default=None, metadata=_INTERNAL)  # ts_utc parsed once, for retention sweeps
+
+    def __post_init__(self) -> None:
+        _stamp(self)
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class VibePoint:
     ts_utc: str
-    level: str  # low|rising|high|unknown
+    level: TensionLevel
     notify: bool
+    ts_epoch: Optional[float] = field(default=None, metadata=_INTERNAL)  # ts_utc parsed once, for retention sweeps
+
+    def __post_init__(self) -> None:
+        _stamp(self)
+
+
+# Perception events, one class per "type" of the sensor response schema.
+@dataclass(slots=True, frozen=True)
+class SpeechEvent:
+    ts_hint: str = "unknown"
+    speaker: str = "unknown"
+    quote: str = ""
+    thought_signature: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass(slots=True, frozen=True)
+class SensorEvent:
+    source: str = ""
+    signal: str = "other"
+    severity: int = 0
+    explanation: str = ""
+    confidence: float = 0.0
+
+
+@dataclass(slots=True, frozen=True)
+class TensionSignalEvent:
+    level: TensionLevel = "unknown"
+    signals: List[str] = field(default_factory=list)
+    explanation: str = ""
+
+
+@dataclass(slots=True, frozen=True)
+class RuleContextEvent:
+    matched_rules: List[str] = field(default_factory=list)
+    why_these_rules: str = ""
+
+
+_EVENT_TYPES = {cls.__name__: cls for cls in (SpeechEvent, SensorEvent, TensionSignalEvent, RuleContextEvent)}
+# Low-cardinality enum fields: interned so retained records share one string object per value.
+_INTERNED = frozenset({"speaker", "source", "signal", "level"})
+
+
+def _event_kwargs(cls: type, ev: Dict[str, Any]) -> Dict[str, Any]:
+    kwargs = {f.name: ev[f.name] for f in fields(cls) if f.name in ev}
+    for name in _INTERNED.intersection(kwargs):
+        if isinstance(kwargs[name], str):
+            kwargs[name] = sys.intern(kwargs[name])
+    return kwargs
+
 
+def typed_events(
+    events: Iterable[Dict[str, Any]],
+) -> Tuple[
+    Tuple[SpeechEvent, ...],
+    Tuple[SensorEvent, ...],
+    Optional[TensionSignalEvent],
+    Optional[RuleContextEvent],
+]:
+    # Groups the model's flat event list by type in one pass; unknown types and extra keys are dropped.
+    grouped: Dict[str, List[Any]] = {name: [] for name in _EVENT_TYPES}
+    for ev in events:
+        cls = _EVENT_TYPES.get(ev.get("type"))
+        if cls is not None:
+            grouped[cls.__name__].append(cls(**_event_kwargs(cls, ev)))
+    return (
+        tuple(grouped["SpeechEvent"]),
+        tuple(grouped["SensorEvent"]),
+        next(iter(grouped["TensionSignalEvent"]), None),
+        next(iter(grouped["RuleContextEvent"]), None),
+    )
 
-@dataclass
+
+@dataclass(slots=True, frozen=True)
 class Tier1Record:
+    # Structured events only, stored per type so consumers read e.g. record.speech without a scan.
     ts_utc: str
-    events: Dict[str, Any]  # structured events only
+    speech: Tuple[SpeechEvent, ...]
+    sensor: Tuple[SensorEvent, ...]
+    tension: Optional[TensionSignalEvent]
+    rules: Optional[RuleContextEvent]
+    notes: Dict[str, Any] = field(default_factory=dict)
+    ts_epoch: Optional[float] = field(default=None, metadata=_INTERNAL)  # ts_utc parsed once, for retention sweeps
+
+    def __post_init__(self) -> None:
+        _stamp(self)
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Tier2Summary:
     ts_utc: str
     summary: str
-    conclusion_type: str
+    conclusion_type: ConclusionType
+    ts_epoch: Optional[float] = field(default=None, metadata=_INTERNAL)  # ts_utc parsed once, for retention sweeps
+
+    def __post_init__(self) -> None:
+        _stamp(self)
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Tier3Embedding:
     ts_utc: str
     embedding_id: str
-    theme: str
+    theme: ConclusionType
+
+
+def shallow_asdict(obj: Any) -> Dict[str, Any]:
+    # Records hold JSON-ready values, so the recursive deep copy of dataclasses.asdict is unnecessary.
+    # Internal bookkeeping fields (ts_epoch) are left out.
+    return {f.name: getattr(obj, f.name) for f in fields(obj) if f.metadata.get("export", True)}
+
+
+@dataclass(slots=True, frozen=True)
+class TurnInputs:
+    # One turn's prompt inputs, passed whole to the prompt builders instead of loose strings.
+    chat: str
+    constitution: str
+    context_notes: str = ""
+    mode: str = "conservative"
+
+
+# -------------------------
+# Gemini response schemas (structured output contracts for core/prompts.py)
+# -------------------------
+def _str(description: str) -> Dict[str, Any]:
+    # Field guidance rides in the schema, so prompts sent with it need not restate the layout.
+    return {"type": "string", "description": description}
+
+
+_SPEAKER = {"type": "string", "enum": ["A", "B", "unknown"]}
+
+SENSOR_RESPONSE_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "events": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "type": {
+                        "type": "string",
+                        "enum": ["SpeechEvent", "SensorEvent", "TensionSignalEvent", "RuleContextEvent"],
+                    },
+                    # SpeechEvent
+                    "ts_hint": _str("e.g., 7:00pm or unknown"),
+                    "speaker": _SPEAKER,
+                    "quote": _str("verbatim quote from chat"),
+                    "thought_signature": {
+                        "type": "object",
+                        "properties": {
+                            "intent": {
+                                "type": "string",
+                                "enum": ["request", "complaint", "defense", "clarify", "boundary", "repair_attempt", "other"],
+                            },
+                            "topic_tags": {
+                                "type": "array",
+                                "items": {
+                                    "type": "string",
+                                    "enum": ["chores", "time", "tone", "fairness", "respect", "money", "family", "other"],
+                                },
+                            },
+                            "implicit_need": _str("short neutral phrase"),
+                        },
+                    },
+                    # SensorEvent
+                    "source": {"type": "string", "enum": ["watch", "camera", "microphone", "environment"]},
+                    "signal": _str("hrv_spike|volume_spike|door_slam|cabinet_slam|silence_withdrawal|other"),
+                    "severity": {"type": "integer"},
+                    "confidence": {"type": "number", "description": "0.0-1.0; never claim certainty"},
+                    # TensionSignalEvent
+                    "level": {"type": "string", "enum": [v for v in get_args(TensionLevel) if v != "unknown"]},
+                    "signals": {
+                        "type": "array",
+                        "items": _str(
+                            "absolute_language|blame|sarcasm|rapid_escalation|exclamation|questioning|interruptions"
+                        ),
+                    },
+                    # SensorEvent / TensionSignalEvent
+                    "explanation": _str("1 neutral sentence"),
+                    # RuleContextEvent
+                    "matched_rules": {"type": "array", "items": _str("short excerpt from the constitution")},
+                    "why_these_rules": _str("1 sentence"),
+                },
+                "required": ["type"],
+            },
+        },
+        "notes": {
+            "type": "object",
+            "properties": {
+                "what_is_simulated": _str("1 sentence"),
+                "privacy_statement": _str("1 sentence: store only derived events, not raw media"),
+            },
+        },
+    },
+    "required": ["events"],
+}
+
+MEDIATOR_RESPONSE_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "fact_receipt": {
+            "type": "object",
+            "properties": {
+                "evidence_from_chat": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "quote": _str("verbatim from SpeechEvent.quote"),
+                            "speaker": _SPEAKER,
+                            "why_it_matters": _str("short neutral explanation"),
+                        },
+                        "required": ["quote", "speaker", "why_it_matters"],
+                    },
+                },
+                "evidence_from_constitution": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "rule_excerpt": _str("short excerpt from constitution"),
+                            "why_it_matters": _str("short"),
+                        },
+                        "required": ["rule_excerpt", "why_it_matters"],
+                    },
+                },
+                "time_window": _str("e.g., last 10 minutes / unknown"),
+            },
+            "required": ["evidence_from_chat", "evidence_from_constitution"],
+        },
+        "conclusion": {
+            "type": "object",
+            "properties": {
+                "type": {"type": "string", "enum": [v for v in get_args(ConclusionType) if v != "unknown"]},
+                "one_sentence_summary": _str("neutral"),
+                "confidence": {"type": "number"},
+            },
+            "required": ["type", "one_sentence_summary"],
+        },
+        "intervention_plan": {
+            "type": "object",
+            "properties": {
+                "should_notify": {"type": "boolean"},
+                "notify_target": {"type": "string", "enum": ["A", "B", "both"]},
+                "channel": {
+                    "type": "string",
+                    "enum": ["watch_haptic", "speaker_voice", "phone_notification", "none"],
+                },
+                "message": _str("1-2 sentence nudge"),
+                "circuit_breaker": {
+                    "type": "object",
+                    "properties": {"recommend_pause_minutes": {"type": "integer"}, "why_pause": _str("short")},
+                },
+            },
+            "required": ["should_notify", "channel"],
+        },
+        "post_conflict_debrief": {
+            "type": "object",
+            "properties": {
+                "for_A": {"type": "array", "items": _str("2-4 concrete actions, respectful, with example phrases")},
+                "for_B": {"type": "array", "items": _str("2-4 concrete actions, respectful, with example phrases")},
+                "rule_update_proposal": _str("one updated rule in plain language"),
+            },
+        },
+        "privacy_and_storage": {
+            "type": "object",
+            "properties": {
+                "store_policy": _str("Tier1 48h events, Tier2 30d summaries, Tier3 embeddings"),
+                "what_is_not_stored": _str("no raw audio/video, no face identity"),
+            },
+        },
+    },
+    "required": ["fact_receipt", "conclusion", "intervention_plan"],
+}
+
+COMBINED_RESPONSE_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "events": SENSOR_RESPONSE_SCHEMA,
+        "mediation": MEDIATOR_RESPONSE_SCHEMA,
+    },
+    "required": ["events", "mediation"],
+}
+
+
+# -------------------------
+# Response validators (compiled once at import)
+# -------------------------
+def compile_validator(response_schema: Dict[str, Any]) -> Callable[[Any], Dict[str, Any]]:
+    # Returns data unchanged or raises ValueError. The response schemas are plain JSON Schema,
+    # so fastjsonschema can generate a validator for them directly.
+    if fastjsonschema is not None:
+        check = fastjsonschema.compile(response_schema)
+
+        def validate(data: Any) -> Dict[str, Any]:
+            try:
+                return check(data)
+            except fastjsonschema.JsonSchemaException as e:
+                raise ValueError(f"Gemini response does not match schema: {e.message}") from e
+
+        return validate
+
+    required = tuple(response_schema.get("required", ()))
+
+    def validate(data: Any) -> Dict[str, Any]:
+        if not isinstance(data, dict) or any(k not in data for k in required):
+            raise ValueError(f"Gemini response does not match schema: expected keys {list(required)}")
+        return data
+
+    return validate
+
+
+validate_sensor = compile_validator(SENSOR_RESPONSE_SCHEMA)
+validate_mediator = compile_validator(MEDIATOR_RESPONSE_SCHEMA)
+validate_combined = compile_validator(COMBINED_RESPONSE_SCHEMA)